@@ -1,10 +1,20 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request
 import requests
+from requests.adapters import HTTPAdapter
 import logging
 import backoff
 import logging
-from cachetools import cached, LRUCache
+from cachetools import cached, LRUCache, TTLCache
+from threading import Lock, Thread
+from concurrent.futures import ThreadPoolExecutor
 import json
+import time
+import hashlib
+import math
+from types import MappingProxyType
+import numpy as np
+import numba
+import orjson
 
 # Configs
 def load_config():
@@ -14,13 +24,88 @@ def load_config():
     with open('config.json', 'r') as config_file:
         return json.load(config_file)
     
-config = load_config()
+config = MappingProxyType(load_config())  # Read-only
+
+# Config values used on the request path, bound once at import
+TAX_API_URL = config['tax_api_url']
+TAX_API_TIMEOUT = (config['tax_api_connect_timeout'], config['tax_api_read_timeout'])  # (connect, read) seconds
+SUPPORTED_YEARS_ORDERED = tuple(config['supported_tax_years'])  # In config order, for warming and refreshing
+SUPPORTED_YEARS = frozenset(SUPPORTED_YEARS_ORDERED)  # For O(1) membership checks
+MAX_RETRIES = config['tax_api_max_retries']
+CACHE_SIZE = config['cache_max_size']
+CACHE_TTL = config['cache_ttl_seconds']
+
+_UNSUPPORTED_MSG = f"Unsupported tax year. Supported years are: {', '.join(map(str, sorted(SUPPORTED_YEARS)))}"
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 # Cache configuration
-cache = LRUCache(maxsize=config['cache_max_size'])  # Cache up to 100 items without expiration
+class TaxDataCache(TTLCache):
+    """
+    TTLCache that drops a tax year's cached responses whenever its data changes, is removed or expires.
+
+    next_expiry is the timer value at which the earliest entry expires, so the request path
+    can tell whether expire() has work to do without taking cache_lock.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._expires = {}
+        self.next_expiry = math.inf
+
+    def __setitem__(self, key, value):
+        old = self.get(key)
+        with self.timer as time:  # Same frozen time TTLCache uses for the entry's expiry
+            super().__setitem__(key, value)
+        self._expires[key] = time + self.ttl
+        self.next_expiry = min(self._expires.values())
+        if old is None or not _same_tax_data(old, value):  # A refresh with unchanged data only extends the TTL
+            _invalidate_responses(key)
+
+    def __delitem__(self, key):
+        super().__delitem__(key)  # An expired key raises after removal; expire() then invalidates it
+        del self._expires[key]
+        self._data_changed([key])
+
+    def expire(self, time=None):
+        if time is None:
+            time = self.timer()
+        super().expire(time)
+        expired = [key for key, expires in self._expires.items() if not time < expires]
+        if expired:
+            for key in expired:
+                del self._expires[key]
+            self._data_changed(expired)
+
+    def _data_changed(self, keys):
+        self.next_expiry = min(self._expires.values(), default=math.inf)
+        for key in keys:
+            _invalidate_responses(key)
+
+def _timer():
+    """
+    Clock of the tax data cache, looked up on every call so tests can patch it.
+    """
+    return time.monotonic()
+
+cache = TaxDataCache(maxsize=CACHE_SIZE, ttl=CACHE_TTL, timer=lambda: _timer())  # Entries expire after the TTL so upstream corrections are picked up
+cache_lock = Lock()
+
+# Serialized JSON bodies of successful responses and their ETags, keyed by (income rounded to the cent, tax year)
+response_cache = LRUCache(maxsize=CACHE_SIZE)
+response_cache_lock = Lock()
+response_generations = {}  # Per tax year, bumped on invalidation so bodies built from replaced data are not stored
+
+def _invalidate_responses(tax_year):
+    with response_cache_lock:
+        for key in [key for key in response_cache if key[1] == tax_year]:
+            del response_cache[key]
+        response_generations[tax_year] = response_generations.get(tax_year, 0) + 1
+
+# Shared HTTP session so connections to the tax API are kept alive and pooled between cache misses
+SESSION = requests.Session()
+SESSION.mount(TAX_API_URL.split('://')[0] + '://',
+              HTTPAdapter(pool_connections=10, pool_maxsize=50, max_retries=0))
 
 app = Flask(__name__)
 
@@ -101,22 +186,61 @@ def calculate_tax():
     tax_year = request.args.get('tax_year', type=int)
 
     if not (annual_income and tax_year):
-        return jsonify({'error': 'Missing required parameters'}), 400
+        return _json({'error': 'Missing required parameters'}, 400)
     
-    if tax_year not in config['supported_tax_years']:
-        return jsonify({'error': f"Unsupported tax year. Supported years are: {', '.join(map(str, config['supported_tax_years']))}"}), 400
+    if tax_year not in SUPPORTED_YEARS:
+        return _json({'error': _UNSUPPORTED_MSG}, 400)
+
+    key = (round(annual_income, 2), tax_year)
 
     try:
-        tax_data = fetch_tax_data(tax_year)
-        total_tax, tax_details, effective_rate = compute_tax(annual_income, tax_data)
-        return jsonify({
-            'total_tax': total_tax,
-            'tax_details': tax_details,
-            'effective_rate': effective_rate
-        })
+        if cache.timer() >= cache.next_expiry:
+            with cache_lock:
+                cache.expire()  # Invalidates cached responses built from expired tax data
+        with response_cache_lock:
+            entry = response_cache.get(key)
+            generation = response_generations.get(tax_year, 0)
+        if entry is None:
+            total_tax, tax_details, effective_rate = compute_tax(key[0], fetch_tax_data(tax_year))
+            body = orjson.dumps({
+                'total_tax': total_tax,
+                'tax_details': tax_details,
+                'effective_rate': effective_rate
+            })
+            entry = (body, hashlib.md5(body, usedforsecurity=False).hexdigest())
+            with response_cache_lock:
+                if generation == response_generations.get(tax_year, 0):
+                    response_cache[key] = entry
+        body, etag = entry
+        response = _json(body)
+        response.set_etag(etag)
+        return response.make_conditional(request)
     except Exception as e:
-        logging.error(f"Error calculating tax: {e}")
-        return jsonify({'error': 'Internal Server Error'}), 500
+        logging.error("Error calculating tax: %s", e, exc_info=True)
+        return _json({'error': 'Internal Server Error'}, 500)
+
+def _json(body, status=200):
+    """
+    Builds a JSON response from an object, serialized with orjson, or from already encoded bytes.
+    """
+    if not isinstance(body, bytes):
+        body = orjson.dumps(body)
+    return Response(body, status=status, mimetype='application/json')
+
+@cached(cache, key=lambda tax_year: tax_year, lock=cache_lock)  # Keyed by the bare year, which the refresher writes to
+@backoff.on_exception(backoff.expo,
+                      (requests.exceptions.RequestException, requests.exceptions.Timeout),
+                      max_tries=MAX_RETRIES,
+                      giveup=lambda e: e.response is not None and e.response.status_code < 500)
+def _get_tax_data(tax_year):
+    """
+    Calls the external tax API; decorated once at import with the cache and the retry strategy.
+    """
+    logging.info('Cache miss, calling the external API for %s', tax_year)
+    url = f'{TAX_API_URL}/{tax_year}'
+    response = SESSION.get(url, timeout=TAX_API_TIMEOUT)
+    response.raise_for_status()  # Raises HTTPError for bad responses
+    return prepare_tax_data(response.json())
 
 def fetch_tax_data(tax_year):
     """
@@ -129,68 +253,128 @@ def fetch_tax_data(tax_year):
     tax_year (int): The year for which to fetch tax data.
 
     Returns:
-    dict: A dictionary containing tax brackets for the specified year.
+    dict: Tax brackets for the specified year, as prepared by prepare_tax_data.
 
     Raises:
     requests.exceptions.HTTPError: If the request to the API endpoint fails with an HTTP error.
     """    
 
-    @cached(cache)
-    @backoff.on_exception(backoff.expo,
-                          (requests.exceptions.RequestException, requests.exceptions.Timeout),
-                          max_tries=config['tax_api_max_retries'],
-                          giveup=lambda e: e.response is not None and e.response.status_code < 500)
-    def get_data(tax_year):
-        logging.info(f'Cache miss, calling the external API for {tax_year}')
-        url = f'{config["tax_api_url"]}/{tax_year}'
-        response = requests.get(url)
-        response.raise_for_status()  # Raises HTTPError for bad responses
-        return response.json()
-
     try:
-        return get_data(tax_year)
+        return _get_tax_data(tax_year)
     except requests.exceptions.HTTPError as e:
-        logging.error(f"Failed to fetch tax data due to an HTTP error: {e}")
+        logging.error("Failed to fetch tax data due to an HTTP error: %s", e)
         raise
     except requests.exceptions.RequestException as e:
-        logging.error(f"Failed to fetch tax data due to a network-related error: {e}")
+        logging.error("Failed to fetch tax data due to a network-related error: %s", e)
         raise
 
+def _same_tax_data(a, b):
+    """
+    Tells whether two results of prepare_tax_data describe the same brackets.
+    """
+    return a['details'] == b['details'] and np.array_equal(a['rates'], b['rates'])
+
+def prepare_tax_data(tax_data):
+    """
+    Converts the tax brackets returned by the API into per-field NumPy arrays.
+
+    Args:
+    tax_data (dict): Contains the list of tax brackets for a specific tax year.
+
+    Returns:
+    dict: 'mins', 'rates' and 'caps' (max - min) arrays and the 'details' response entries,
+    all sorted by bracket min.
+    """
+    brackets = sorted(tax_data['tax_brackets'], key=lambda bracket: bracket['min'])
+    mins = np.array([bracket['min'] for bracket in brackets], dtype=float)
+    maxs = np.array([bracket.get('max', np.inf) for bracket in brackets], dtype=float)  # Open bracket has no max
+    rates = np.array([bracket['rate'] for bracket in brackets], dtype=float)
+    # Per-bracket response entries without tax_paid; the open bracket has no 'max' key
+    details = [{key: bracket[key] for key in ('min', 'max') if key in bracket} for bracket in brackets]
+
+    return {'mins': mins, 'rates': rates, 'caps': maxs - mins, 'details': details}
+
+@numba.njit(cache=True)
+def _compute_tax_soa(income, mins, caps, rates):
+    """
+    Compiled kernel of compute_tax: returns the total tax and the tax paid in each bracket below income.
+    """
+    # Brackets are sorted by min, so the loop stops at the first one above the income
+    taxes = np.empty(mins.shape[0])
+    total_tax = 0.0
+    active = 0
+    while active < mins.shape[0] and income > mins[active]:
+        tax = min(income - mins[active], caps[active]) * rates[active]
+        taxes[active] = tax
+        total_tax += tax
+        active += 1
+    return total_tax, taxes[:active]
+
 def compute_tax(income, tax_data):
     """
     Calculate total income tax based on income and tax brackets.
 
     Args:
     income (float): The annual income of the individual.
-    tax_data (dict): Contains the list of tax brackets for a specific tax year.
+    tax_data (dict): Tax brackets for a specific tax year, as prepared by prepare_tax_data.
 
     Returns:
     tuple: total_tax, detailed tax per bracket, and effective tax rate.
     """
-    total_tax = 0
-    tax_details = []
-    brackets = tax_data['tax_brackets']
-
-    for bracket in brackets:
-        if 'max' in bracket:
-            if income > bracket['min']:
-                taxable_income = min(income, bracket['max']) - bracket['min']
-                tax = taxable_income * bracket['rate']
-                total_tax += tax
-                tax = round(tax, 2)  # Rounding to the nearest cent
-                tax_details.append({'min': bracket['min'], 'max': bracket['max'], 'tax_paid': tax})
-        else:
-            if income > bracket['min']:
-                taxable_income = income - bracket['min']
-                tax = taxable_income * bracket['rate']
-                total_tax += tax
-                tax = round(tax, 2)  # Rounding to the nearest cent
-                tax_details.append({'min': bracket['min'], 'tax_paid': round(tax, 2)})
-    
+    total_tax, taxes = _compute_tax_soa(float(income), tax_data['mins'], tax_data['caps'], tax_data['rates'])
+    rounded_taxes = [round(tax, 2) for tax in taxes.tolist()]  # Rounding to the nearest cent; np.round can be a cent off
+
+    tax_details = [{**detail, 'tax_paid': tax} for detail, tax in zip(tax_data['details'], rounded_taxes)]
+
     effective_rate = round((total_tax / income) * 100, 2) if income > 0 else 0  # Rounding the percentage
     total_tax = round(total_tax, 2)
 
     return total_tax, tax_details, effective_rate
 
+def _warm_year(tax_year):
+    try:
+        compute_tax(1.0, fetch_tax_data(tax_year))  # Also compiles _compute_tax_soa ahead of user requests
+    except Exception as e:
+        logging.warning('Failed to warm the cache for %s: %s', tax_year, e)
+
+def warm_cache():
+    """
+    Loads tax data for every supported year so user requests are served from the cache.
+
+    Years are fetched in parallel over the pooled SESSION connections, each with its own retries.
+    """
+    with ThreadPoolExecutor(max_workers=min(8, len(SUPPORTED_YEARS_ORDERED))) as executor:
+        list(executor.map(_warm_year, SUPPORTED_YEARS_ORDERED))
+
+def _refresh_year(tax_year):
+    try:
+        tax_data = _get_tax_data.__wrapped__(tax_year)  # Bypasses the cache, keeping the current entry until this succeeds
+    except Exception as e:
+        logging.warning('Failed to refresh the tax data for %s: %s', tax_year, e)
+        return
+    with cache_lock:
+        cache[tax_year] = tax_data
+
+def _refresh_cache(interval):
+    """
+    Re-fetches the tax data for every supported year every interval seconds.
+
+    Cached entries are only replaced by successful fetches, so an API outage never evicts good data.
+    """
+    while True:
+        time.sleep(interval)
+        with ThreadPoolExecutor(max_workers=min(8, len(SUPPORTED_YEARS_ORDERED))) as executor:
+            list(executor.map(_refresh_year, SUPPORTED_YEARS_ORDERED))
+
+def start_cache_refresher():
+    """
+    Starts a background thread keeping the cache warm for the lifetime of the process.
+
+    Threads do not survive fork(), so forking servers must call this in every worker.
+    """
+    Thread(target=_refresh_cache, args=(CACHE_TTL / 2,), daemon=True).start()
+
 if __name__ == '__main__':
-    app.run(debug=True)
\ No newline at end of file
+    warm_cache()
+    start_cache_refresher()
+    app.run()
\ No newline at end of file
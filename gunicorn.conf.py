@@ -0,0 +1,19 @@
+"""
+Gunicorn settings, picked up automatically when running `gunicorn` from the project root.
+"""
+wsgi_app = 'wsgi:application'
+bind = '127.0.0.1:5000'
+
+# Each worker process has its own cache and refresher, so scale with threads rather than processes
+workers = 2
+worker_class = 'gthread'
+threads = 8
+
+# Import the app (and warm the cache) once in the master before forking workers
+preload_app = True
+
+def post_fork(server, worker):
+    from app import SESSION, start_cache_refresher
+    # Drop the keep-alive connections inherited from the master, so workers never share a socket
+    SESSION.close()
+    start_cache_refresher()
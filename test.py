@@ -3,7 +3,10 @@ from unittest.mock import patch, Mock
 from flask import Flask, jsonify
 import requests
 
-from app import app
+from app import app, cache, response_cache, CACHE_TTL, SUPPORTED_YEARS_ORDERED, compute_tax, fetch_tax_data, prepare_tax_data, warm_cache, _invalidate_responses, _refresh_year
+
+# Two brackets, the second one open
+TAX_DATA_2021 = prepare_tax_data({'tax_brackets': [{'min': 0, 'max': 50197, 'rate': 0.15}, {'min': 50197, 'rate': 0.2}]})
 
 class TestTaxCalculation(unittest.TestCase):
 
@@ -12,6 +15,9 @@ class TestTaxCalculation(unittest.TestCase):
         self.app = app.test_client()
         # Propagate the exceptions to the test client
         self.app.testing = True
+        # Start every test with cold caches
+        cache.clear()
+        response_cache.clear()
 
     def test_without_query_params(self):
         # Test calling endpoint without query parameters
@@ -28,7 +34,7 @@ class TestTaxCalculation(unittest.TestCase):
     def test_with_valid_request(self):
         # Test with a valid salary and year, expect exact json response
         with patch('app.fetch_tax_data') as mock_fetch:
-            mock_fetch.return_value = {'tax_brackets': [{'min': 0, 'max': 50197, 'rate': 0.15}, {'min': 50197, 'rate': 0.2}]}
+            mock_fetch.return_value = TAX_DATA_2021
             response = self.app.get('/calculate-tax?annual_income=145000&tax_year=2021')
             self.assertEqual(response.status_code, 200)
             expected_json = {
@@ -38,9 +44,82 @@ class TestTaxCalculation(unittest.TestCase):
             }
             self.assertEqual(response.json, expected_json)
 
+    def test_repeated_request_is_memoized(self):
+        # Identical queries (up to the cent) should compute the tax only once
+        with patch('app.fetch_tax_data') as mock_fetch:
+            mock_fetch.return_value = TAX_DATA_2021
+            first = self.app.get('/calculate-tax?annual_income=145000&tax_year=2021')
+            second = self.app.get('/calculate-tax?annual_income=145000.001&tax_year=2021')
+            self.assertEqual(first.json, second.json)
+            mock_fetch.assert_called_once_with(2021)
+
+    def test_body_not_cached_after_invalidation(self):
+        # A body computed while the tax data was being replaced must not be stored
+        def fetch_then_invalidate(tax_year):
+            _invalidate_responses(tax_year)
+            return TAX_DATA_2021
+        with patch('app.fetch_tax_data', side_effect=fetch_then_invalidate):
+            response = self.app.get('/calculate-tax?annual_income=145000&tax_year=2021')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response_cache), 0)
+
+    def test_expired_tax_data_is_refetched(self):
+        # Moving the cache's clock past the TTL drops the cached responses and refetches the year
+        now = [1000.0]
+        with patch('app._timer', lambda: now[0]), patch('app.SESSION.get') as mock_get:
+            mock_get.return_value.json.side_effect = [
+                {'tax_brackets': [{'min': 0, 'rate': 0.1}]},
+                {'tax_brackets': [{'min': 0, 'rate': 0.2}]}
+            ]
+            first = self.app.get('/calculate-tax?annual_income=1000&tax_year=2021')
+            self.app.get('/calculate-tax?annual_income=1000&tax_year=2021')
+            self.assertEqual(mock_get.call_count, 1)
+
+            now[0] += CACHE_TTL
+            second = self.app.get('/calculate-tax?annual_income=1000&tax_year=2021')
+            self.assertEqual(mock_get.call_count, 2)
+            self.assertEqual(first.json['total_tax'], 100.0)
+            self.assertEqual(second.json['total_tax'], 200.0)
+
+    def test_refresh_invalidates_only_changed_year(self):
+        # Unchanged data keeps the cached responses, changed data drops only that year's
+        cache[2020] = TAX_DATA_2021
+        cache[2021] = TAX_DATA_2021
+        self.app.get('/calculate-tax?annual_income=145000&tax_year=2020')
+        self.app.get('/calculate-tax?annual_income=145000&tax_year=2021')
+
+        cache[2021] = prepare_tax_data({'tax_brackets': [{'min': 0, 'max': 50197, 'rate': 0.15}, {'min': 50197, 'rate': 0.2}]})
+        self.assertEqual(len(response_cache), 2)
+
+        cache[2021] = prepare_tax_data({'tax_brackets': [{'min': 0, 'rate': 0.1}]})
+        self.assertEqual(list(response_cache), [(145000.0, 2020)])
+
+        # A failed delete leaves the cached responses alone
+        with self.assertRaises(KeyError):
+            del cache[2019]
+        self.assertEqual(list(response_cache), [(145000.0, 2020)])
+
+    def test_not_modified(self):
+        # A client sending back the ETag gets an empty 304
+        with patch('app.fetch_tax_data') as mock_fetch:
+            mock_fetch.return_value = TAX_DATA_2021
+            first = self.app.get('/calculate-tax?annual_income=145000&tax_year=2021')
+            etag = first.headers['ETag']
+            second = self.app.get('/calculate-tax?annual_income=145000&tax_year=2021', headers={'If-None-Match': etag})
+            self.assertEqual(second.status_code, 304)
+            self.assertEqual(second.data, b'')
+
+        # Once the tax data changes, the old ETag no longer matches
+        response_cache.clear()
+        with patch('app.fetch_tax_data') as mock_fetch:
+            mock_fetch.return_value = prepare_tax_data({'tax_brackets': [{'min': 0, 'rate': 0.1}]})
+            third = self.app.get('/calculate-tax?annual_income=145000&tax_year=2021', headers={'If-None-Match': etag})
+            self.assertEqual(third.status_code, 200)
+            self.assertEqual(third.json['total_tax'], 14500.0)
+
     def test_transient_error_and_recovery(self):
         # Simulate responses from the tax API: first a 500 error, then a successful JSON response
-        with patch('requests.get') as mock_get:
+        with patch('app.SESSION.get') as mock_get:
             # Create a mock response for the 500 error
             mock_response_error = Mock()
             mock_response_error.raise_for_status.side_effect = requests.exceptions.HTTPError()
@@ -66,5 +145,46 @@ class TestTaxCalculation(unittest.TestCase):
             }
             self.assertEqual(response.json, expected_json)
 
+    def test_open_bracket_tax_paid(self):
+        # The open bracket's tax should be rounded to the cent exactly once
+        tax_data = prepare_tax_data({'tax_brackets': [{'min': 0, 'max': 1000, 'rate': 0.1}, {'min': 1000, 'rate': 0.333}]})
+        total_tax, tax_details, effective_rate = compute_tax(2000.5, tax_data)
+        self.assertEqual(tax_details[-1], {'min': 1000, 'tax_paid': 333.17})
+        self.assertEqual(total_tax, 433.17)
+
+    def test_tax_paid_rounds_like_round(self):
+        # 41502.3 * 0.15 is 6225.345 as a float, which round() takes up and np.round takes down
+        total_tax, tax_details, effective_rate = compute_tax(41502.3, TAX_DATA_2021)
+        self.assertEqual(tax_details, [{'min': 0, 'max': 50197, 'tax_paid': 6225.35}])
+        self.assertEqual(total_tax, 6225.35)
+
+    def test_low_income_skips_higher_brackets(self):
+        # Only brackets starting below the income are reported
+        tax_data = prepare_tax_data({'tax_brackets': [{'min': 1000, 'rate': 0.3}, {'min': 0, 'max': 1000, 'rate': 0.1}]})
+        self.assertEqual(compute_tax(500, tax_data), (50.0, [{'min': 0, 'max': 1000, 'tax_paid': 50.0}], 10.0))
+        self.assertEqual(compute_tax(1000, tax_data), (100.0, [{'min': 0, 'max': 1000, 'tax_paid': 100.0}], 10.0))
+
+    def test_warm_cache(self):
+        # Every supported year should be fetched, and a failing year should not stop the others
+        with patch('app.fetch_tax_data') as mock_fetch:
+            tax_data = prepare_tax_data({'tax_brackets': [{'min': 0, 'rate': 0.15}]})
+            mock_fetch.side_effect = [requests.exceptions.ConnectionError()] + [tax_data] * (len(SUPPORTED_YEARS_ORDERED) - 1)
+            warm_cache()
+            self.assertCountEqual([c.args[0] for c in mock_fetch.call_args_list], SUPPORTED_YEARS_ORDERED)
+
+    def test_refresh_keeps_data_on_failure(self):
+        # A failed refresh keeps the cached year, a successful one replaces it
+        cache[2021] = TAX_DATA_2021
+        with patch('app._get_tax_data.__wrapped__') as mock_fetch:
+            mock_fetch.side_effect = requests.exceptions.ConnectionError()
+            _refresh_year(2021)
+            self.assertIs(fetch_tax_data(2021), TAX_DATA_2021)
+
+            new_data = prepare_tax_data({'tax_brackets': [{'min': 0, 'rate': 0.1}]})
+            mock_fetch.side_effect = None
+            mock_fetch.return_value = new_data
+            _refresh_year(2021)
+            self.assertIs(fetch_tax_data(2021), new_data)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,9 @@
+"""
+WSGI entry point for production servers, e.g. `gunicorn wsgi:application`.
+"""
+from app import app, warm_cache
+
+# With gunicorn's preload_app this runs once in the master, and forked workers share the warmed cache
+warm_cache()
+
+application = app